@@ -1,5 +1,6 @@
 import pygame
 import time
+import gc
 
 from utilities import *
 from Layouts import *
@@ -10,12 +11,12 @@ from Menu import *
 pygame.init()
 
 # Settings
-bg_music = pygame.mixer.Sound(ASSETS_PATH+"game-over-danijel-zambo-main-version-1394-02-03.mp3")
+bg_music = Assets.sound(ASSETS_PATH+"game-over-danijel-zambo-main-version-1394-02-03.mp3")
 
 class Game:
     def __init__(self):
         # Display
-        self.master_window = pygame.display.set_mode(tuple(wind_size), VIDEO_FLAGS | pygame.NOFRAME)
+        self.master_window = Display.set_mode(tuple(wind_size), VIDEO_FLAGS | pygame.NOFRAME)
         self.window = self.master_window.copy()
 
         self.scenes = {
@@ -27,6 +28,8 @@ class Game:
         self.scenes["GameOver"]=  GameOverMenu(self.scenes["Tetris"])
 
         self.active_scenes = [self.scenes["Main"]]
+        # Present the whole window next frame, set when the scenes change
+        self.redraw_all = True
 
     def switch_scene(self, new_scene):
         if new_scene in self.scenes:
@@ -34,15 +37,27 @@ class Game:
             self.active_scenes.clear()
             self.active_scenes.append(self.scenes[new_scene])
             self.active_scenes[-1].enter()
+            self.redraw_all = True
+            # Collect here rather than in the middle of gameplay
+            gc.collect()
 
     def popup_scene(self, new_scene):
+        # The scenes underneath are covered, so they redraw everything
+        for s in self.active_scenes:
+            if hasattr(s, "invalidate"):
+                s.invalidate()
         self.active_scenes.append(self.scenes[new_scene])
         self.active_scenes[-1].enter()
+        self.redraw_all = True
 
     def close_scene(self, amount=1):
         for _ in range(min(amount, len(self.active_scenes)-1)):
             #TODO self.active_scenes[-1].exit()
             self.active_scenes.pop()
+        # The scene below was covered, so it has to redraw everything
+        if hasattr(self.active_scenes[-1], "invalidate"):
+            self.active_scenes[-1].invalidate()
+        self.redraw_all = True
 
     def start(self):
         self.running = True
@@ -90,10 +105,19 @@ class Game:
                     case 3:
                         self.close_scene()
 
-            pygame.display.update()
+            # Scenes that know what changed (the game) only present that
+            rects = getattr(self.active_scenes[-1], "frame_rects", None)
+            if self.redraw_all or rects is None:
+                pygame.display.update()
+            else:
+                pygame.display.update(rects)
+            self.redraw_all = False
 
 def main():
     game = Game()
+    # Assets and scenes live for the whole run, stop the GC scanning them
+    gc.collect()
+    gc.freeze()
     game.start()
 
 try:
@@ -110,3 +110,94 @@ BOW = """
 101
 """
 
+
+
+# Offsets tried in order when a rotation is blocked
+KICKS = ((0, 0), (-1, 0), (1, 0), (0, -1), (-2, 0), (2, 0))
+
+
+def rotate_layout(layout):
+    # The layout turned a quarter clockwise
+    rows = layout.split()
+    width = max(map(len, rows))
+    rows = [row.ljust(width, '0') for row in rows]
+    return "\n"+"\n".join(''.join(row[x] for row in reversed(rows))
+                           for x in range(width))+"\n"
+
+
+class Shape:
+    # A layout compiled to cell offsets, row bitmasks and edge profiles
+    __slots__ = ("layout", "width", "height", "cells", "row_masks",
+                 "top", "bottom", "left", "right",
+                 "family", "cw", "ccw", "cw_kicks", "ccw_kicks")
+
+    def __init__(self, layout):
+        rows = layout.split()
+        self.layout = layout
+        self.height = len(rows)
+        self.width = max(map(len, rows))
+
+        self.cells = tuple((x, y)
+                           for y in range(len(rows))
+                           for x in range(len(rows[y])) if rows[y][x] == '1')
+        self.row_masks = tuple(sum(1 << x for x, y in self.cells if y == row)
+                               for row in range(self.height))
+
+        # Highest/lowest filled row of each column (-1 if empty)
+        columns = [[y for x, y in self.cells if x == column]
+                   for column in range(self.width)]
+        self.top = tuple(min(c) if c else -1 for c in columns)
+        self.bottom = tuple(max(c) if c else -1 for c in columns)
+
+        # Leftmost/rightmost filled column of each row (-1 if empty)
+        rows = [[x for x, y in self.cells if y == row]
+                for row in range(self.height)]
+        self.left = tuple(min(r) if r else -1 for r in rows)
+        self.right = tuple(max(r) if r else -1 for r in rows)
+
+        # Filled in by add_rotations
+        self.family = layout
+        self.cw = self.ccw = layout
+        self.cw_kicks = self.ccw_kicks = ((0, 0),)
+
+    def pivot(self):
+        # Cell the shape turns around, relative to its top left
+        return self.width//2, self.height//2
+
+
+LAYOUTS = (DONUT, O, T, T1, T2, T3, L, L1, L2, L3, I, I1,
+           Z, Z1, S, S1, SLASH, SLASH1, FISH, FISH1, BOW)
+
+SHAPES = {layout: Shape(layout) for layout in LAYOUTS}
+
+
+def add_rotations(shapes, layouts):
+    # Links every layout to its clockwise/anticlockwise turns. Layouts that
+    # are turns of an earlier one join its family (T1..T3 are turns of T),
+    # missing turns (e.g. of FISH) are added to shapes. The kicks already
+    # include the offset that keeps the pivot in place.
+    for layout in layouts:
+        if shapes[layout].family != layout:
+            continue
+        family = [layout]
+        turned = rotate_layout(layout)
+        while turned != layout:
+            family.append(turned)
+            turned = rotate_layout(turned)
+        for turn in family:
+            if turn not in shapes:
+                shapes[turn] = Shape(turn)
+            shapes[turn].family = layout
+        for i, turn in enumerate(family):
+            shape, cw = shapes[turn], shapes[family[(i+1) % len(family)]]
+            shape.cw = cw.layout
+            cw.ccw = shape.layout
+            (px, py), (nx, ny) = shape.pivot(), cw.pivot()
+            shape.cw_kicks = tuple((px-nx+kx, py-ny+ky) for kx, ky in KICKS)
+            cw.ccw_kicks = tuple((nx-px+kx, ny-py+ky) for kx, ky in KICKS)
+
+
+add_rotations(SHAPES, LAYOUTS)
+
+# Stable number for every shape, for hashing
+LAYOUT_IDS = {layout: i for i, layout in enumerate(SHAPES)}
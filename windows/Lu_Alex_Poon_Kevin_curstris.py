@@ -1,5 +1,7 @@
 import pygame
 import time
+import gc
+import math
 
 from utilities import *
 from Layouts import *
@@ -10,13 +12,20 @@ from Menu import *
 pygame.init()
 
 # Settings
-bg_music = pygame.mixer.Sound(ASSETS_PATH+"game-over-danijel-zambo-main-version-1394-02-03.mp3")
+bg_music = Assets.sound(ASSETS_PATH+"game-over-danijel-zambo-main-version-1394-02-03.mp3")
 
 class Game:
     def __init__(self):
         # Display
-        self.master_window = pygame.display.set_mode(tuple(wind_size), VIDEO_FLAGS | pygame.NOFRAME)
+        self.master_window = Display.set_mode(tuple(wind_size), VIDEO_FLAGS | pygame.NOFRAME)
         self.window = self.master_window.copy()
+        # Size of the display the scale below was worked out for, and the
+        # set_mode it was made by
+        self.output_size = None
+        self.mode = Display.modes
+        # Per axis, every `step` window pixels scale to exactly `scaled`
+        # display pixels
+        self.step = self.scaled = (1, 1)
 
         self.scenes = {
             "Main": MainMenu(),
@@ -27,6 +36,8 @@ class Game:
         self.scenes["GameOver"]=  GameOverMenu(self.scenes["Tetris"])
 
         self.active_scenes = [self.scenes["Main"]]
+        # Present the whole window next frame, set when the scenes change
+        self.redraw_all = True
 
     def switch_scene(self, new_scene):
         if new_scene in self.scenes:
@@ -34,15 +45,92 @@ class Game:
             self.active_scenes.clear()
             self.active_scenes.append(self.scenes[new_scene])
             self.active_scenes[-1].enter()
+            self.redraw_all = True
+            # Collect here rather than in the middle of gameplay
+            gc.collect()
 
     def popup_scene(self, new_scene):
+        # The scenes underneath are covered, so they redraw everything
+        for s in self.active_scenes:
+            if hasattr(s, "invalidate"):
+                s.invalidate()
         self.active_scenes.append(self.scenes[new_scene])
         self.active_scenes[-1].enter()
+        self.redraw_all = True
 
     def close_scene(self, amount=1):
         for _ in range(min(amount, len(self.active_scenes)-1)):
             #TODO self.active_scenes[-1].exit()
             self.active_scenes.pop()
+        # The scene below was covered, so it has to redraw everything
+        if hasattr(self.active_scenes[-1], "invalidate"):
+            self.active_scenes[-1].invalidate()
+        self.redraw_all = True
+
+    def target(self):
+        # Scenes draw straight to the display at the native size, otherwise
+        # to self.window which is scaled up as it's presented
+        display = pygame.display.get_surface()
+        size = display.get_size()
+        if size != self.output_size:
+            # Resized: work out the scale once
+            gcds = [math.gcd(a, b) for a, b in zip(self.window.get_size(), size)]
+            self.step = [a//g for a, g in zip(self.window.get_size(), gcds)]
+            self.scaled = [b//g for b, g in zip(size, gcds)]
+        if (size != self.output_size or display is not self.master_window
+                or self.mode != Display.modes):
+            # set_mode cleared the display, so everything is drawn again
+            self.output_size = size
+            self.master_window = display
+            self.mode = Display.modes
+            for s in self.active_scenes:
+                if hasattr(s, "invalidate"):
+                    s.invalidate()
+            self.redraw_all = True
+        if size == self.window.get_size():
+            return self.master_window
+        return self.window
+
+    def scale_rect(self, rect):
+        # Grows rect to whole steps, where scaling just that part gives the
+        # same pixels as scaling the whole window. Returns it and the
+        # display area it scales to
+        (sx, sy), (dx, dy) = self.step, self.scaled
+        left, top = rect.left//sx, rect.top//sy
+        right, bottom = -(-rect.right//sx), -(-rect.bottom//sy)
+        source = pygame.Rect(left*sx, top*sy, (right-left)*sx, (bottom-top)*sy)
+        output = pygame.Rect(left*dx, top*dy, (right-left)*dx, (bottom-top)*dy)
+        return source, output
+
+    def present(self, window):
+        if pygame.display.get_surface().get_size() != self.output_size:
+            # Resized during update, this frame was drawn for the old size.
+            # The next target() redraws everything for the new one
+            return
+        # Scenes that know what changed only present that
+        rects = getattr(self.active_scenes[-1], "frame_rects", None)
+        if window is self.master_window:
+            if self.redraw_all or rects is None:
+                pygame.display.update()
+            else:
+                pygame.display.update(rects)
+        elif self.redraw_all or rects is None:
+            # Into the display surface, so no new surface every frame
+            pygame.transform.scale(self.window, self.output_size, self.master_window)
+            pygame.display.update()
+        else:
+            bounds = self.window.get_rect()
+            outputs = []
+            for rect in rects:
+                rect = rect.clip(bounds)
+                if not (rect.width and rect.height):
+                    continue
+                source, output = self.scale_rect(rect)
+                pygame.transform.scale(self.window.subsurface(source), output.size,
+                                       self.master_window.subsurface(output))
+                outputs.append(output)
+            pygame.display.update(outputs)
+        self.redraw_all = False
 
     def start(self):
         self.running = True
@@ -78,7 +166,9 @@ class Game:
                     # Game Input
                     held_keys_duration.pop(event.key)
         
-            scene_status = self.active_scenes[-1].update(delta_t, self.window, events)
+            window = self.target()
+            # Every scene is drawn below, so update only updates
+            scene_status = self.active_scenes[-1].update(delta_t, window, events, redraw=False)
             if scene_status:
                 match scene_status["id"]:
                     case -1:
@@ -91,13 +181,14 @@ class Game:
                         self.close_scene()
 
             for s in self.active_scenes:
-                s.draw(self.window)
-
-            self.master_window.blit(pygame.transform.scale(self.window, self.master_window.get_size()), (0, 0))
-            pygame.display.update()
+                s.draw(window)
+            self.present(window)
 
 def main():
     game = Game()
+    # Assets and scenes live for the whole run, stop the GC scanning them
+    gc.collect()
+    gc.freeze()
     game.start()
 
 try:
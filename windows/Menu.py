@@ -4,10 +4,8 @@ from utilities import *
 
 class Menu:
     def __init__(self,options, pos, font, anti_alias=True, padding=0, bg_colour=(0,0,0)):
-        self.cursor_img = pygame.image.load(ASSETS_PATH+"cursor.png").convert_alpha()
-        self.receiver_img = pygame.image.load(ASSETS_PATH+"cursor_receive.png").convert_alpha()
-        self.enter_sound = pygame.mixer.Sound(ASSETS_PATH+"pickupCoin.wav")
-        self.click_sound = pygame.mixer.Sound(ASSETS_PATH+"blipSelect.wav")
+        self.enter_sound = Assets.sound(ASSETS_PATH+"pickupCoin.wav")
+        self.click_sound = Assets.sound(ASSETS_PATH+"blipSelect.wav")
 
         # Menu options and text style
         self.options = options
@@ -23,11 +21,11 @@ class Menu:
             for option in self.options]
 
         # Selection cursor
-        scale_value = self.options_texts[0].get_height()/self.cursor_img.get_height()
-        self.cursor_img = pygame.transform.scale_by(self.cursor_img, scale_value)
+        scale_value = self.options_texts[0].get_height()/Assets.image(ASSETS_PATH+"cursor.png").get_height()
+        self.cursor_img = Assets.image(ASSETS_PATH+"cursor.png", scale=scale_value)
         self.cursor_rect = self.cursor_img.get_rect()
 
-        self.receiver_img = pygame.transform.scale_by(self.receiver_img, scale_value)
+        self.receiver_img = Assets.image(ASSETS_PATH+"cursor_receive.png", scale=scale_value)
         self.rec_rect = self.receiver_img.get_rect()
 
         self.cursor_size = self.rec_rect.width+self.cursor_rect.width
@@ -40,7 +38,7 @@ class Menu:
         self.size.x += 2*self.padding
         self.size.y += self.padding
 
-        self.surf = pygame.Surface(tuple(self.size))
+        self.surf = Display.surface(self.size)
         if pos == "CENTERED":
             self.menu_pos = (Vector2(point=pygame.display.get_window_size())-self.size)*0.5
         else:
@@ -64,8 +62,28 @@ class Menu:
         self.cursor_anim = Animation(self.cursor_rect, "topleft", self.cursor_tween, 120)
 
         self.set_cursor_pos()
+        Display.on_change(self.convert)
+
+        # Cursor state last drawn (None: not since enter), and the areas
+        # that changed with it (None: all of the window)
+        self.drawn = None
+        self.changed = []
+
+    def convert(self):
+        # Surfaces in a new display format
+        self.surf = Display.convert(self.surf)
+        self.cursor_img = Display.convert(self.cursor_img)
+        self.receiver_img = Display.convert(self.receiver_img)
     
+    @property
+    def frame_rects(self):
+        # Menus only change when the cursor moves, and then only the menu
+        # box. The first draw after enter is all of the window, it may come
+        # a frame after the scene change was presented
+        return self.changed
+
     def enter(self):
+        self.drawn = None
         self.selected = 0
         self.cursor_anim.reset(True)
         self.set_cursor_pos()
@@ -84,20 +102,25 @@ class Menu:
         self.surf.fill(self.bg_colour)
 
         # Options
-        for i in range(len(self.options)):
-            blit_pos_y = i*(self.text_size.y+self.padding)+self.padding
-            self.surf.blit(
-                self.options_texts[i],
-                (self.padding, blit_pos_y))
+        commands = [
+            (self.options_texts[i], (self.padding, i*(self.text_size.y+self.padding)+self.padding))
+            for i in range(len(self.options))]
 
         # Cursor
-        self.surf.blit(
-            self.receiver_img,
-            (self.rec_rect.left, self.cursor_rect.top))
-        self.surf.blit(self.cursor_img, self.cursor_rect)
+        commands.append((self.receiver_img, (self.rec_rect.left, self.cursor_rect.top)))
+        commands.append((self.cursor_img, self.cursor_rect))
+        self.surf.blits(commands, doreturn=False)
 
         # Menu to Window
         window.blit(self.surf, tuple(self.menu_pos))
+        state = (self.selected, tuple(self.cursor_rect.topleft))
+        if self.drawn is None:
+            self.changed = None
+        elif state == self.drawn:
+            self.changed = []
+        else:
+            self.changed = [self.surf.get_rect(topleft=tuple(self.menu_pos))]
+        self.drawn = state
 
     def update(self, delta_t, window, events, redraw=True):
 
@@ -164,18 +187,28 @@ class MainMenu(Menu):
         super().__init__(
             options,
             "CENTERED",
-            pygame.font.SysFont("Impact", 42),
+            Assets.font("Impact", 42),
             True,
             10,
             BK)
 
-        self.title = pygame.image.load(ASSETS_PATH+"title.png").convert_alpha()
+        self.title = Assets.image(ASSETS_PATH+"title.png")
         self.title_rect = self.title.get_rect()
         self.title_rect.center = pygame.display.get_surface().get_rect().center
         self.title_rect.top = pygame.display.get_window_size()[1]*0.15
 
-        self.help_text = pygame.font.SysFont("Impact", 26).render("Controls: W,A,S,D or UP,DOWN,LEFT,RIGHT to move", self.anti_alias, R)
-        self.help_text2 = pygame.font.SysFont("Impact", 26).render("          SPACE or RETURN to select an option - That's it!", self.anti_alias, R)
+        self.help_text = Assets.font("Impact", 26).render("Controls: W,A,S,D or UP,DOWN,LEFT,RIGHT to move, Q,E to rotate", self.anti_alias, R)
+        self.help_text2 = Assets.font("Impact", 26).render("          SPACE or RETURN to select an option - That's it!", self.anti_alias, R)
+
+    @property
+    def frame_rects(self):
+        # draw fills all of the window
+        return None
+
+    def convert(self):
+        super().convert()
+        # The cached title was converted, this one is still the old one
+        self.title = Assets.image(ASSETS_PATH+"title.png")
 
     def draw(self, window):
         window.fill(BK)
@@ -200,13 +233,16 @@ class PauseMenu(Menu):
         super().__init__(
             options,
             "CENTERED",
-            pygame.font.SysFont("Impact", 32),
+            Assets.font("Impact", 32),
             True,
             10,
             (0,0,0))
 
 
 class GameOverMenu(Menu):
+    # Frames until blending the red background in again stops changing it
+    FADE_FRAMES = 60
+
     def __init__(self, game):
         options = [
             {"name": "RESTART", "colour": PY,
@@ -219,20 +255,32 @@ class GameOverMenu(Menu):
         super().__init__(
             options,
             "CENTERED",
-            pygame.font.SysFont("Impact", 32),
+            Assets.font("Impact", 32),
             True,
             10,
             (100,20,1))
 
-        self.bg = pygame.display.get_surface().copy()
-        self.bg.set_alpha(40)
+        self.bg = Display.surface(pygame.display.get_window_size(), alpha=40)
         self.bg.fill(R)
-        self.title_font = pygame.font.SysFont("Ink free", 60)
+        self.title_font = Assets.font("Ink free", 60)
 
         self.game = game
+        self.faded = 0
+
+    @property
+    def frame_rects(self):
+        # All of the window while the red fades in
+        if self.faded < GameOverMenu.FADE_FRAMES:
+            return None
+        return self.changed
+
+    def convert(self):
+        super().convert()
+        self.bg = Display.convert(self.bg)
 
     def enter(self):
         super().enter()
+        self.faded = 0
         self.texts = (
             self.font.render("Highscore: "+str(self.game.highscore), True, BK),
             self.font.render("Score: "+str(self.game.points), True, BK),
@@ -240,6 +288,7 @@ class GameOverMenu(Menu):
 
     def draw(self, window):
         window.blit(self.bg,(0,0))
+        self.faded += 1
 
         for i in range(len(self.texts)):
             window.blit(self.texts[i],
@@ -253,19 +302,27 @@ class GameOverMenu(Menu):
 class ScreenAdjust:
     def __init__(self, master_window, window):
         self.master_window = master_window
-        self.font = pygame.font.SysFont('Impact', 40)
+        self.font = Assets.font('Impact', 40)
 
-        self.bg = master_window.copy()
+        self.bg = Display.surface(master_window.get_size(), alpha=160)
         self.bg.fill(BK)
-        self.bg.set_alpha(160)
 
         self.text = self.font.render("Adjust Screen (Press [ESCAPE] when done)", True, W)
         self.text_rect = self.text.get_rect()
         self.text_rect.center = master_window.get_rect().center
+        Display.on_change(self.convert)
+
+    def convert(self):
+        self.bg = Display.convert(self.bg)
+
+    @property
+    def frame_rects(self):
+        # Drawn the same every frame, set_mode presents the whole window
+        return []
 
     def enter(self):
         print("adjusting screen")
-        self.master_window = pygame.display.set_mode(self.master_window.get_size(),VIDEO_FLAGS | pygame.RESIZABLE)
+        self.master_window = Display.set_mode(self.master_window.get_size(),VIDEO_FLAGS | pygame.RESIZABLE)
 
     def draw(self, window):
         window.blit(self.bg, (0,0))
@@ -276,9 +333,9 @@ class ScreenAdjust:
             if event.type == pygame.VIDEORESIZE:
                 size = list(event.size)
                 size[0] = size[1]*window.get_width()/window.get_height()
-                self.master_window = pygame.display.set_mode(size, VIDEO_FLAGS | pygame.RESIZABLE)
+                self.master_window = Display.set_mode(size, VIDEO_FLAGS | pygame.RESIZABLE)
         if Input.is_just_pressed("UI_CANCEL"):
-            self.master_window = pygame.display.set_mode(self.master_window.get_size(),VIDEO_FLAGS | pygame.NOFRAME)
+            self.master_window = Display.set_mode(self.master_window.get_size(),VIDEO_FLAGS | pygame.NOFRAME)
             return {"id": 3}
 
         if redraw:
@@ -291,7 +348,7 @@ class Credits(Menu):
             [{"name": "Back", "colour": R,
              "on_select": "scene", "select_args": {"id": 3}},],
             Vector2(20,20),
-            pygame.font.SysFont("Impact", 26),
+            Assets.font("Impact", 26),
             True,
             10,
             (100,20,1))
@@ -315,6 +372,11 @@ class Credits(Menu):
         self.text_rect.center = pygame.display.get_surface().get_rect().center
         self.text_rect.height /= 10
 
+    @property
+    def frame_rects(self):
+        # draw fills all of the window
+        return None
+
     def draw(self, window):
         window.fill(BK)
         super().draw(window)
@@ -333,7 +395,7 @@ if __name__ == "__main__":
         ]
     m = Menu(options,
              Vector2(9,9),
-             pygame.font.SysFont("Impact", 32, bold=True),
+             Assets.font("Impact", 32, bold=True),
              True,
              10,
              (0,0,0,10)
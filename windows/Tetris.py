@@ -1,5 +1,10 @@
 import pygame
 import random
+from operator import itemgetter
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from utilities import *
 LTI = LootTableItem
@@ -8,6 +13,12 @@ from Layouts import *
 # SETTINGS
 wind_size = Vector2(800, 900)
 GRID_DIMS = Vector2(10,20)
+# Cells shown at once, bigger boards (e.g. 200x400) scroll to follow the block
+VIEW_DIMS = Vector2(10,20)
+GRID_BACKEND = "bitboard" # "bitboard" or "numpy"
+# "tiles" blits each locked tile, "indexed" scales a one pixel per cell
+# board and lays the tile pattern over it (same cost for any number of tiles)
+BOARD_RENDERER = "tiles"
 
 # Game ticks
 tps = 20 
@@ -17,11 +28,18 @@ player_move_delay = 10
 lock_delay = 22
 lock_delay_timer = pygame.USEREVENT + 1
 
-# Tile info
-tile_size = wind_size.y/22.5
+# Tile info (sized so the view fits the window, in whole pixels so the
+# board layer can be scrolled by whole tiles)
+tile_size = int(min(wind_size.y/(VIEW_DIMS.y+2.5), wind_size.x*0.55/VIEW_DIMS.x))
 grid_size = Vector2(tile_size*GRID_DIMS.x, tile_size*GRID_DIMS.y)
 square_speed = tile_size
-grid_drop_pos = Vector2(5,-1)
+# Size of a cell in the queue previews
+queue_tile_size = 20
+grid_drop_pos = Vector2(GRID_DIMS.x//2,-1)
+# Coloured tile sprites kept, and bits per channel of their colours
+# (below 8 rounds similar colours to one sprite)
+TILE_CACHE_SIZE = 128
+TILE_COLOUR_BITS = 8
 
 # Game grid
 grid = pygame.Rect((wind_size.x-grid_size.x)/2, (wind_size.y-grid_size.y)/2,
@@ -29,126 +47,694 @@ grid = pygame.Rect((wind_size.x-grid_size.x)/2, (wind_size.y-grid_size.y)/2,
 
 
 
+class GridTransform:
+    # A cell remap: new cell (x, y) takes old cell (columns[x], rows[y])
+    def __init__(self, dims, rows=None, columns=None):
+        self.rows = list(range(dims.y)) if rows is None else list(rows)
+        self.columns = None if columns is None else list(columns)
+        if sorted(self.rows) != list(range(dims.y)):
+            raise ValueError("expected rows to be a permutation of range("+str(dims.y)+")")
+
+        # Columns moved right by shift (left if negative), wrapping around,
+        # or None for any other reordering
+        self.shift = 0
+        if self.columns == list(range(dims.x)):
+            self.columns = None
+        if self.columns is None:
+            return
+        if sorted(self.columns) != list(range(dims.x)):
+            raise ValueError("expected columns to be a permutation of range("+str(dims.x)+")")
+
+        shift = -self.columns[0] % dims.x
+        if self.columns != [(x-shift) % dims.x for x in range(dims.x)]:
+            self.shift = None
+        else:
+            self.shift = shift if shift <= dims.x//2 else shift-dims.x
+
+        self.get_columns = itemgetter(*self.columns)
+        # Bit tables: for each byte of a row mask, where its bits end up
+        self.tables = [[0]*256 for _ in range(0, dims.x, 8)]
+        for x in range(dims.x):
+            table = self.tables[self.columns[x]//8]
+            bit = 1 << self.columns[x]%8
+            for value in range(256):
+                if value & bit:
+                    table[value] |= 1 << x
+
+    def remap_mask(self, mask):
+        if self.columns is None:
+            return mask
+        new = 0
+        for table in self.tables:
+            new |= table[mask & 255]
+            mask >>= 8
+        return new
+
+    def remap_colours(self, colours):
+        if self.columns is None:
+            return colours
+        return bytearray(self.get_columns(colours))
+
+
+MASK64 = (1 << 64)-1
+
+
+def mix64(value):
+    # splitmix64 finaliser
+    value = (value+0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ value >> 30)*0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ value >> 27)*0x94D049BB133111EB) & MASK64
+    return value ^ value >> 31
+
+
+class Zobrist:
+    # Keys for a 64 bit board hash. A row's key is the xor of the keys of
+    # its filled columns, and the board hash xors each row key mixed with
+    # its row, so shifting or reordering rows only re-mixes the row keys
+    def __init__(self, dims, seed=0):
+        # Fixed seed so hashes match between runs
+        rng = random.Random(seed)
+        self.columns = [rng.getrandbits(64) for _ in range(dims.x)]
+        self.rows = [rng.getrandbits(64) for _ in range(dims.y)]
+
+        # Key tables: for each byte of a row mask, the xor of its columns
+        self.tables = [[0]*256 for _ in range(0, dims.x, 8)]
+        for x in range(dims.x):
+            table = self.tables[x//8]
+            bit = 1 << x%8
+            for value in range(256):
+                if value & bit:
+                    table[value] ^= self.columns[x]
+
+    def row_key(self, mask):
+        key = 0
+        for table in self.tables:
+            key ^= table[mask & 255]
+            mask >>= 8
+        return key
+
+    def row_term(self, y, key):
+        # Empty rows add nothing, so an empty board hashes to 0
+        return mix64(key ^ self.rows[y]) if key else 0
+
+    def board_hash(self, row_keys):
+        board = 0
+        for y, key in enumerate(row_keys):
+            board ^= self.row_term(y, key)
+        return board
+
+
 class Grid:
-    def __init__(self, window, pos, dims, colour=(255,255,255)):
+    def __init__(self, window, pos, dims, colour=(255,255,255), view_dims=None):
         self.dims = dims
-        self.size = dims*tile_size
-
-        self.map = [[0 for i in range(dims.x)] for i in range(dims.y)]
+        # Visible cells, only these are drawn
+        if view_dims is None:
+            view_dims = dims
+        self.view = pygame.Rect(0, 0, min(dims.x, view_dims.x), min(dims.y, view_dims.y))
+        self.size = Vector2(*self.view.size)*tile_size
+
+        # Bitboards: one int per row, bit x set if column x is filled
+        self.full_row = (1 << dims.x)-1
+        # Locked tiles only store a colour index per cell
+        self.palette = Palette(colour)
+        # Bumped whenever the locked tiles change
+        self.version = 0
+        self.scroll_transforms = {}
+        self.zobrist = Zobrist(dims)
+        self.reset()
 
-        self.bg = pygame.Surface(tuple(self.size))
+        self.bg = Display.surface(self.size)
         if pos == "CENTERED":
             self.pos = (Vector2(point=window.get_size())-self.size)*0.5
         else:
             self.pos = pos
 
-        tile_sprite = pygame.image.load(ASSETS_PATH+"tile.png").convert_alpha()
+        # One tile.png per cell with no overlap, so every row and column of
+        # the background looks the same and the layer can move them. The
+        # same sprite as the tiles, so both renderers look alike
+        self.tile_sprite = TintedTiles.base()
 
         self.bg.fill(W)
-        for y in range(dims.y):
-            for x in range(dims.x):
-                self.bg.blit(tile_sprite, (x*tile_size,y*tile_size))
+        for y in range(self.view.height):
+            for x in range(self.view.width):
+                self.bg.blit(self.tile_sprite, (x*tile_size,y*tile_size))
+
+        # Background and locked tiles of the view, kept between frames
+        self.layer = self.bg.copy()
+        self.layer_view = None
+
+        if BOARD_RENDERER == "indexed":
+            # Palette index of each cell of the view, scaled up to the layer
+            self.indexed = pygame.Surface(self.view.size, depth=8)
+            self.indexed_scaled = pygame.Surface(self.layer.get_size(), depth=8)
+            # The tile pattern alone, to draw over the scaled cells
+            self.tile_overlay = Display.surface(self.layer.get_size(), per_pixel=True)
+            for y in range(self.view.height):
+                for x in range(self.view.width):
+                    self.tile_overlay.blit(self.tile_sprite, (x*tile_size,y*tile_size))
 
     def reset(self):
-        self.map = [[0 for i in range(self.dims.x)] for i in range(self.dims.y)]
+        self.clear_cells()
+        self.palette.clear()
+        # Surface profile: first filled row of each column (dims.y if
+        # empty) and the number of locked tiles in each row and column
+        self.tops = [self.dims.y]*self.dims.x
+        self.row_fill = [0]*self.dims.y
+        self.column_fill = [0]*self.dims.x
+        # Zobrist key of each row and the hash of the locked tiles
+        self.row_keys = [0]*self.dims.y
+        self.hash = 0
+        # Board layer needs redrawing / cells to add to it
+        self.layer_dirty = True
+        self.layer_cells = []
+        self.version += 1
+
+    def clear_cells(self):
+        # Locked tiles and the falling block are tracked separately
+        self.rows = [0]*self.dims.y
+        self.active = [0]*self.dims.y
+        self.colours = [bytearray(self.dims.x) for _ in range(self.dims.y)]
+
+    @property
+    def map(self):
+        # 1: locked, 2: falling block
+        return [[(self.rows[y] >> x & 1) | (self.active[y] >> x & 1) << 1
+                 for x in range(self.dims.x)] for y in range(self.dims.y)]
 
     def __str__(self):
         return('\n'.join(map(lambda x: ''.join(map(str,x)),self.map)))
 
     def grid_pos_to_coord(self, grid_pos):
-        return (self.pos.x+grid_pos.x*tile_size, self.pos.y+grid_pos.y*tile_size)
-
-    def update_tile(self, prev_pos, new_pos):
-        if new_pos.y >-1:
-            self.map[new_pos.y][new_pos.x] = 2
-        if self.map[prev_pos.y][prev_pos.x] != 2 and prev_pos.y > -1:
-            self.map[prev_pos.y][prev_pos.x] = 0
-
-    def update_map(self):
-        self.map = list(map(
-            lambda x: list(map(
-                lambda y: int(bool(y)), x)), self.map))
-
-    def clear_lines(self, tiles, window, start=0,end=None,amount=1):
-        cleared = []
-        for i in range(amount):
-            row = start+i
-            if all(self.map[row]):
-                cleared.append(row)
-    
-        for row in sorted(cleared):
-            del self.map[row]
-            self.map.insert(0, [0 for _ in range(self.dims.x)])
-            tile = 0
-            while tile < len(tiles):
-                if tiles[tile].grid_pos.y == row:
-                    del tiles[tile]
-                    tile -= 1
-                elif tiles[tile].grid_pos.y < row:
-                    tiles[tile].grid_pos.y += 1
-                    tiles[tile].update(1, window)
-                tile += 1
+        return (self.pos.x+(grid_pos.x-self.view.x)*tile_size,
+                self.pos.y+(grid_pos.y-self.view.y)*tile_size)
+
+    def follow(self, x, y, width, height, margin=2):
+        # Scrolls the view as little as possible to keep the area in it
+        view = self.view
+        left = min(max(view.left, x+width+margin-view.width), x-margin)
+        top = min(max(view.top, y+height+margin-view.height), y-margin)
+        view.left = min(max(left, 0), self.dims.x-view.width)
+        view.top = min(max(top, 0), self.dims.y-view.height)
+
+    def clip_rect(self, above=0):
+        # Screen area of the view, with rows above the board while at the top
+        if self.view.top:
+            above = 0
+        return pygame.Rect(self.pos.x, self.pos.y-above*tile_size,
+                           self.size.x, self.size.y+above*tile_size)
+
+    def occupied(self, x, y):
+        return self.rows[y] >> x & 1
+
+    def collides(self, shape, x, y):
+        # Tests the whole shape at (x, y) against walls, floor and locked tiles
+        if x < 0 or x+shape.width > self.dims.x or y+shape.height > self.dims.y:
+            return True
+        rows = self.rows
+        masks = shape.row_masks
+        for row in range(shape.height):
+            if y+row > -1 and rows[y+row] & masks[row] << x:
+                return True
+        return False
+
+    def add_active(self, cells):
+        for cell in cells:
+            if cell.y > -1:
+                self.active[cell.y] |= 1 << cell.x
+
+    def remove_active(self, cells):
+        for cell in cells:
+            if cell.y > -1:
+                self.active[cell.y] &= ~(1 << cell.x)
+
+    def lock_active(self, cells, colour):
+        index = self.palette.index(colour)
+        locked = 0
+        for cell in cells:
+            if cell.y > -1:
+                locked += 1
+                self.lock_cell(cell.x, cell.y, index)
+                self.toggle_key(cell.x, cell.y)
+                self.layer_cells.append((cell.x, cell.y, index))
+                self.tops[cell.x] = min(self.tops[cell.x], cell.y)
+                self.row_fill[cell.y] += 1
+                self.column_fill[cell.x] += 1
+        self.palette.hold(index, locked)
+        self.version += 1
+
+    def lock_cell(self, x, y, index):
+        self.active[y] &= ~(1 << x)
+        self.rows[y] |= 1 << x
+        self.colours[y][x] = index
+
+    def toggle_key(self, x, y):
+        # Flips cell (x, y) in its row key and the board hash
+        old = self.row_keys[y]
+        new = old ^ self.zobrist.columns[x]
+        self.row_keys[y] = new
+        self.hash ^= self.zobrist.row_term(y, old) ^ self.zobrist.row_term(y, new)
+
+    def row_key(self, y):
+        return self.zobrist.row_key(self.rows[y])
+
+    def full_rows(self, start, amount):
+        return [row for row in range(start, start+amount)
+                if self.row_fill[row] == self.dims.x]
+
+    def remove_rows(self, rows):
+        for row in rows:
+            for x in range(self.dims.x):
+                if self.occupied(x, row):
+                    self.column_fill[x] -= 1
+                    self.palette.hold(self.colours[row][x], -1)
+        # Rows under the lowest removed one keep their hash terms
+        bottom = max(rows)+1
+        for y in range(bottom):
+            self.hash ^= self.zobrist.row_term(y, self.row_keys[y])
+        for row in sorted(rows):
+            del self.row_fill[row]
+            self.row_fill.insert(0, 0)
+            del self.row_keys[row]
+            self.row_keys.insert(0, 0)
+        for y in range(bottom):
+            self.hash ^= self.zobrist.row_term(y, self.row_keys[y])
+        self.delete_rows(rows)
+        # The rows left slide down over the removed ones
+        kept = [y for y in range(self.dims.y) if y not in rows]
+        self.move_layer_rows([None]*len(rows)+kept)
+
+        # Only full rows are removed, so columns with tiles above them just
+        # move down and the rest are looked for under the removed rows
+        top = min(rows)
+        missing = 0
+        for x in range(self.dims.x):
+            if self.tops[x] < top:
+                self.tops[x] += len(rows)
+            else:
+                missing |= 1 << x
+        self.update_tops(top+len(rows), missing)
+
+    def apply_transform(self, transform):
+        # Remaps occupancy and colour in one pass, then the profile
+        self.remap_cells(transform)
+        self.row_fill = [self.row_fill[row] for row in transform.rows]
+        if transform.columns is not None:
+            self.column_fill = [self.column_fill[x] for x in transform.columns]
+            self.tops = [self.tops[x] for x in transform.columns]
+            self.row_keys = [self.row_key(y) for y in range(self.dims.y)]
+        else:
+            self.row_keys = [self.row_keys[row] for row in transform.rows]
+        self.hash = self.zobrist.board_hash(self.row_keys)
+        if transform.shift == 0:
+            self.move_layer_rows(transform.rows)
+        elif transform.shift is None or transform.rows != list(range(self.dims.y)):
+            self.layer_dirty = True
+        else:
+            self.scroll_layer(transform.shift)
+        if transform.rows != list(range(self.dims.y)):
+            self.update_tops()
+        self.version += 1
+
+    def flip_transform(self):
+        # Flip the grid, keeping the empty rows on top
+        flipped = range(self.dims.y-1, -1, -1)
+        order = ([row for row in flipped if not self.row_fill[row]]
+                 + [row for row in flipped if self.row_fill[row]])
+        return GridTransform(self.dims, rows=order)
+
+    def scroll_transform(self, direction):
+        if direction not in self.scroll_transforms:
+            self.scroll_transforms[direction] = GridTransform(
+                self.dims, columns=[(x-direction) % self.dims.x for x in range(self.dims.x)])
+        return self.scroll_transforms[direction]
+
+    def delete_rows(self, rows):
+        for row in sorted(rows):
+            del self.rows[row]
+            self.rows.insert(0, 0)
+            del self.colours[row]
+            self.colours.insert(0, bytearray(self.dims.x))
+
+    def remap_cells(self, transform):
+        self.rows = [transform.remap_mask(self.rows[row]) for row in transform.rows]
+        self.colours = [transform.remap_colours(self.colours[row]) for row in transform.rows]
+
+    def update_tops(self, start=0, columns=None):
+        # Walks down the rows until every column (of the mask) has been seen
+        if columns is None:
+            columns = self.full_row
+        tops = self.tops
+        seen = self.full_row & ~columns
+        new = columns
+        while new:
+            low = new & -new
+            tops[low.bit_length()-1] = self.dims.y
+            new ^= low
+        for y in range(start, self.dims.y):
+            if seen == self.full_row:
+                break
+            new = self.rows[y] & ~seen
+            while new:
+                low = new & -new
+                tops[low.bit_length()-1] = y
+                new ^= low
+            seen |= self.rows[y]
+        self.version += 1
+
+    def height(self, x):
+        return self.dims.y-self.tops[x]
+
+    def holes(self, x):
+        # Empty cells under the top of the column
+        return self.height(x)-self.column_fill[x]
+
+    def stack_height(self):
+        return self.dims.y-min(self.tops)
+
+    def in_danger(self, rows=2):
+        return self.stack_height() > self.dims.y-rows
+
+    def drop_row(self, shape, x, y):
+        # Landing row from the column tops and the shape's bottom profile
+        land = min(self.tops[x+column]-1-shape.bottom[column]
+                   for column in range(shape.width) if shape.bottom[column] > -1)
+        if land >= y:
+            return land
+        # Under an overhang, so step down instead
+        while not self.collides(shape, x, y+1):
+            y += 1
+        return y
+
+    def clear_lines(self, start=0,end=None,amount=1):
+        cleared = self.full_rows(start, amount)
+        if cleared:
+            self.remove_rows(cleared)
         return cleared
 
-    def invert_grid(self, tiles, window):
-        self.map = self.map[::-1]
-    
-        row = 0
-        start = 0
-        while row < self.dims.y:
-            if not any(self.map[row]):
-                self.map.insert(0,self.map.pop(row))
-                start += 1
-            row += 1
-    
-        for tile in tiles:
-            tile.grid_pos.y = start+self.dims.y-tile.grid_pos.y-1
-            tile.update(1, window, update_grid=False)
+    def invert_grid(self):
+        self.apply_transform(self.flip_transform())
 
-    def scroll_grid(self, tiles, window, direction):
+    def scroll_grid(self, direction):
         if direction == None:
             direction = random.randint(0,1)*2-1
-    
-        d = (self.dims.x - direction) % self.dims.x
-        for row in range(len(self.map)):
-            self.map[row] = self.map[row][d:] + self.map[row][:d]
-    
-        for tile in tiles:
-            tile.grid_pos.x += direction
-            if not -1 < tile.grid_pos.x < self.dims.x:
-                tile.grid_pos.x = (tile.grid_pos.x + self.dims.x) % self.dims.x
-            tile.update(1, window, update_grid=False)
+        self.apply_transform(self.scroll_transform(direction))
+
+    def locked_cells(self, view=None):
+        # (x, y, colour index) of the locked tiles, within view if given
+        if view is None:
+            view = (0, 0, self.dims.x, self.dims.y)
+        left, top, width, height = view
+        mask = ((1 << width)-1) << left
+        for y in range(top, top+height):
+            bits = self.rows[y] & mask
+            while bits:
+                low = bits & -bits
+                x = low.bit_length()-1
+                yield x, y, self.colours[y][x]
+                bits ^= low
+
+    def blit_cells(self, surface, cells, left, top):
+        # (left, top) is where cell (0, 0) would go on surface
+        sprites = {}
+        commands = []
+        for x, y, index in cells:
+            if index not in sprites:
+                sprites[index] = TintedTiles.get(self.palette[index])
+            commands.append((sprites[index], (left+x*tile_size, top+y*tile_size)))
+        surface.blits(commands, doreturn=False)
+
+    def board_layer(self):
+        # Redrawn when rows move or the view scrolls, locks only add cells
+        if BOARD_RENDERER == "indexed":
+            return self.indexed_layer()
+        left, top = -self.view.x*tile_size, -self.view.y*tile_size
+        if self.layer_dirty or self.layer_view != self.view.topleft:
+            self.layer.blit(self.bg, (0, 0))
+            self.blit_cells(self.layer, self.locked_cells(self.view), left, top)
+        else:
+            self.blit_cells(self.layer, self.layer_cells, left, top)
+        self.layer_dirty = False
+        self.layer_view = self.view.topleft
+        self.layer_cells.clear()
+        return self.layer
+
+    def convert(self):
+        # Surfaces in a new display format, the layer is drawn again
+        self.tile_sprite = TintedTiles.base()
+        self.bg = Display.convert(self.bg)
+        self.layer = Display.convert(self.layer)
+        if BOARD_RENDERER == "indexed":
+            self.tile_overlay = Display.convert(self.tile_overlay)
+        self.layer_dirty = True
+
+    def cell_indices(self, view):
+        # Palette index of each cell in view, row by row
+        return b"".join(self.colours[y][view.left:view.right]
+                        for y in range(view.top, view.bottom))
+
+    def indexed_layer(self):
+        # One scale and two blits, however many tiles are locked
+        if self.layer_dirty or self.layer_cells or self.layer_view != self.view.topleft:
+            pitch = self.indexed.get_pitch()
+            buffer = self.indexed.get_buffer()
+            data = self.cell_indices(self.view)
+            width = self.view.width
+            for y in range(self.view.height):
+                buffer.write(data[y*width:(y+1)*width], y*pitch)
+            del buffer
+            colours = [TintedTiles.quantise(colour) for colour in self.palette.colours]
+            self.indexed.set_palette(colours)
+            self.indexed_scaled.set_palette(colours)
+            pygame.transform.scale(self.indexed, self.layer.get_size(), self.indexed_scaled)
+            self.layer.blit(self.indexed_scaled, (0, 0))
+            self.layer.blit(self.tile_overlay, (0, 0))
+        self.layer_dirty = False
+        self.layer_view = self.view.topleft
+        self.layer_cells.clear()
+        return self.layer
+
+    def patch_layer(self):
+        # Whether the layer can be moved in place: it shows the current view
+        # and is drawn tile by tile. Locked cells waiting to be added go in
+        # first, at their old places
+        if (self.layer_dirty or self.layer_view != self.view.topleft
+                or BOARD_RENDERER == "indexed"):
+            self.layer_dirty = True
+            return False
+        self.blit_cells(self.layer, self.layer_cells,
+                        -self.view.x*tile_size, -self.view.y*tile_size)
+        self.layer_cells.clear()
+        return True
+
+    def redraw_layer(self, cells):
+        # Background and locked tiles of the cells rect of the board
+        area = pygame.Rect((cells.x-self.view.x)*tile_size, (cells.y-self.view.y)*tile_size,
+                           cells.width*tile_size, cells.height*tile_size)
+        self.layer.blit(self.bg, area, area)
+        self.blit_cells(self.layer, self.locked_cells(cells),
+                        -self.view.x*tile_size, -self.view.y*tile_size)
+
+    def move_layer_rows(self, sources):
+        # Row y of the layer takes old row sources[y] (None: empty). Runs of
+        # rows that move together are one blit, rows coming from outside the
+        # view are drawn again. The tile art isn't symmetric, so flipped
+        # rows are moved one by one instead of flipping the surface
+        if sources == list(range(self.dims.y)) or not self.patch_layer():
+            return
+        view = self.view
+        old = self.layer.copy()
+        width = self.layer.get_width()
+        y = view.top
+        while y < view.bottom:
+            source = sources[y]
+            if source == y:
+                y += 1
+            elif source is None or not view.top <= source < view.bottom:
+                self.redraw_layer(pygame.Rect(view.left, y, view.width, 1))
+                y += 1
+            else:
+                start = y
+                while (y+1 < view.bottom and sources[y+1] is not None
+                       and sources[y+1]-y == source-start+1 and sources[y+1] < view.bottom):
+                    y += 1
+                y += 1
+                self.layer.blit(old, (0, (start-view.top)*tile_size),
+                                (0, (source-view.top)*tile_size, width, (y-start)*tile_size))
+
+    def scroll_layer(self, shift):
+        # Columns move shift cells right (left if negative), the ones that
+        # come into the view are drawn again
+        if not self.patch_layer():
+            return
+        view = self.view
+        self.layer.scroll(shift*tile_size, 0)
+        if shift > 0:
+            self.redraw_layer(pygame.Rect(view.left, view.top, shift, view.height))
+        else:
+            self.redraw_layer(pygame.Rect(view.right+shift, view.top, -shift, view.height))
+
+
+class NumpyGrid(Grid):
+    # Stores the board as a uint8 array so analysis tools can share it
+    def __init__(self, window, pos, dims, colour=(255,255,255), view_dims=None):
+        if np is None:
+            raise ImportError("NumpyGrid requires numpy (pip install numpy)")
+        self.cells = np.zeros((dims.y, dims.x), np.uint8)
+        self.active = np.zeros((dims.y, dims.x), np.uint8)
+        self.colours = np.zeros((dims.y, dims.x), np.uint8)
+        super().__init__(window, pos, dims, colour, view_dims)
+        self.column_keys = np.array(self.zobrist.columns, np.uint64)
+
+    def clear_cells(self):
+        # In place, so shared views of the board stay valid
+        self.cells[:] = 0
+        self.active[:] = 0
+        self.colours[:] = 0
+
+    @property
+    def map(self):
+        return (self.cells | self.active << 1).tolist()
+
+    def occupied(self, x, y):
+        return self.cells[y, x]
+
+    def collides(self, shape, x, y):
+        if x < 0 or x+shape.width > self.dims.x or y+shape.height > self.dims.y:
+            return True
+        cells = self.cells
+        for cx, cy in shape.cells:
+            if y+cy > -1 and cells[y+cy, x+cx]:
+                return True
+        return False
+
+    def add_active(self, cells):
+        for cell in cells:
+            if cell.y > -1:
+                self.active[cell.y, cell.x] = 1
+
+    def remove_active(self, cells):
+        for cell in cells:
+            if cell.y > -1:
+                self.active[cell.y, cell.x] = 0
+
+    def lock_cell(self, x, y, index):
+        self.active[y, x] = 0
+        self.cells[y, x] = 1
+        self.colours[y, x] = index
+
+    def row_key(self, y):
+        return int(np.bitwise_xor.reduce(self.column_keys[self.cells[y] != 0]))
+
+    def delete_rows(self, rows):
+        # Rows under the lowest removed one stay put
+        bottom = max(rows)+1
+        keep = np.ones(bottom, np.bool_)
+        keep[rows] = False
+        for layer in (self.cells, self.colours):
+            layer[len(rows):bottom] = layer[:bottom][keep]
+            layer[:len(rows)] = 0
+
+    def remap_cells(self, transform):
+        if transform.columns is None:
+            index = transform.rows
+        else:
+            index = np.ix_(transform.rows, transform.columns)
+        for layer in (self.cells, self.colours):
+            layer[:] = layer[index]
+
+    def update_tops(self, start=0, columns=None):
+        below = self.cells[start:]
+        if below.size:
+            tops = np.where(below.any(axis=0), below.argmax(axis=0)+start, self.dims.y).tolist()
+        else:
+            tops = [self.dims.y]*self.dims.x
+        if columns is None:
+            self.tops = tops
+        else:
+            for x in range(self.dims.x):
+                if columns >> x & 1:
+                    self.tops[x] = tops[x]
+        self.version += 1
+
+    def locked_cells(self, view=None):
+        if view is None:
+            view = (0, 0, self.dims.x, self.dims.y)
+        left, top, width, height = view
+        ys, xs = np.nonzero(self.cells[top:top+height, left:left+width])
+        ys += top
+        xs += left
+        return zip(xs.tolist(), ys.tolist(), self.colours[ys, xs].tolist())
+
+    def cell_indices(self, view):
+        return self.colours[view.top:view.bottom, view.left:view.right].tobytes()
+
+
+GRID_BACKENDS = {"bitboard": Grid, "numpy": NumpyGrid}
+
+
+class TintedTiles:
+    # The tile sprite composited onto each colour, so a cell is one opaque blit
+    cache = LRUCache(TILE_CACHE_SIZE)
+
+    @staticmethod
+    def quantise(colour):
+        # Rounds each channel to the middle of its TILE_COLOUR_BITS bucket
+        drop = 8-TILE_COLOUR_BITS
+        if drop <= 0:
+            return tuple(colour)
+        return tuple(c >> drop << drop | 1 << drop-1 for c in colour)
+
+    @staticmethod
+    def base():
+        # tile.png scaled to a cell
+        base = Assets.image(ASSETS_PATH+"tile.png")
+        return Assets.image(ASSETS_PATH+"tile.png", scale=tile_size/base.get_width())
+
+    @staticmethod
+    def get(colour):
+        colour = TintedTiles.quantise(colour)
+        sprite = TintedTiles.cache.get(colour)
+        if sprite is None:
+            sprite = Display.surface((tile_size, tile_size))
+            sprite.fill(colour)
+            sprite.blit(TintedTiles.base(), (0, 0))
+            TintedTiles.cache[colour] = sprite
+        return sprite
+
+
+Display.on_change(TintedTiles.cache.clear)
 
 
 class Tile(pygame.Rect):
-    def __init__(self, grid, colour, grid_pos=Vector2(5,0), collision_list=None):
+    def __init__(self, grid, colour, grid_pos=Vector2(5,0)):
         super().__init__(0, 0, tile_size, tile_size)
-        self.sprite = pygame.image.load(ASSETS_PATH+"tile.png").convert_alpha()
+        self.reset(grid, colour, grid_pos)
+
+    # Reuse a pooled tile
+    def reset(self, grid, colour, grid_pos):
         self.colour = colour
         self.hide = False
 
         self.grid = grid
-        self.collision_list = collision_list
 
         self.grid_pos = grid_pos
-        self.prev_grid_pos = self.grid_pos
         self.falling = True
 
     def draw(self, window):
         if self.hide:
             return
-        pygame.draw.rect(window,self.colour,self)
-        window.blit(self.sprite, self)
+        window.blit(TintedTiles.get(self.colour), self)
+
+    def queue_draw(self, commands):
+        # draw, as a blit added to a BlitBuffer
+        if not self.hide:
+            commands.add(TintedTiles.get(self.colour), self)
 
-    def update(self, delta_t, window, redraw=True, update_grid=True):
+    def update(self, delta_t, window, redraw=True):
         # Set position
         prev_pos = self.topleft
         self.topleft = self.grid.grid_pos_to_coord(self.grid_pos)
 
-        if update_grid and self.grid_pos != self.prev_grid_pos:
-            self.grid.update_tile(self.prev_grid_pos, self.grid_pos)
-        self.prev_grid_pos = self.grid_pos.copy()
-
         # Uncomment for resetting lock delay if moving
         if not self.falling and self.topleft != prev_pos:
             self.falling = True
@@ -158,81 +744,57 @@ class Tile(pygame.Rect):
             self.draw(window)
 
 
-class TileList(list):
-    def __init__(self, *items):
-        if not all(type(x) == Tile for x in items):
-            raise TypeError("Not all items are of type 'Tile'")
-        super().__init__(items)
-
-    def draw(self, window):
-        for tile in self:
-            tile.draw(window)
+class Block:
+    # Freed blocks and tiles are reused by later spawns
+    pool = None
+    tile_pool = Pool(Tile)
 
+    def __init__(self, grid, layout, colour):
+        self.tiles = []
+        self._grid_pos = Vector2(0, 0)
+        self.reset(grid, layout, colour)
 
-class Block:
-    def __init__(self, grid, layout, colour, collision_list):
+    def reset(self, grid, layout, colour):
         self.layout = layout
+        self.shape = SHAPES[layout]
         self.colour = colour
 
-        convert = layout.split()
-
-        self._grid_pos = grid_drop_pos.copy()
-        self._grid_pos.x -= len(convert[0])//2
-        self._grid_pos.y -= len(convert)-1
+        # Moved in place, a reused block keeps its vectors
+        self._grid_pos.x = grid_drop_pos.x-self.shape.width//2
+        self._grid_pos.y = grid_drop_pos.y-(self.shape.height-1)
 
         self._bin_grid_pos = None
         self.grid_pos_updated = False
         
         self.grid = grid
-        self.collision_list = collision_list
         self.falling = True
 
-        self.tiles = []
-        self.only_tiles = None
-
-
-        for row in range(len(convert)):
-            if not convert[row].strip():
-                continue
-            self.tiles.append([])
-            for column in range(len(convert[row])):
-                if convert[row][column] == '1':
-                    drop_pos = self._grid_pos+Vector2(column, row)
-                    self.tiles[row].append(
-                        Tile(self.grid, colour, drop_pos, collision_list))
-                else:
-                    self.tiles[row].append(None)
-        self.icon_surf = pygame.Surface((tile_size*len(self.tiles[0]),tile_size*len(self.tiles)))
-        for y in range(len(self.tiles)):
-            for x in range(len(self.tiles[y])):
-                if not self.tiles[y][x]:
-                    continue
-                tile = self.tiles[y][x]
-                tile.topleft = (x*tile_size, y*tile_size)
-                tile.draw(self.icon_surf)
-    
-    @staticmethod
-    def factory(layout, grid, collision_list):
-        colour = [random.randint(0,255) for i in range(3)]
-        if sum(colour)/3 > 200:
-            colour = list(map(lambda x: int(x*0.8), colour))
-        return Block(grid, layout, colour, collision_list)
+        # Landing row, cached against the position and grid version
+        self.ghost_key = None
+        self.ghost_row = None
+
+        # One tile per cell of the shape, in the same order. The list and
+        # the tiles (with their grid_pos) are kept from the last use
+        tiles = self.tiles
+        cells = self.shape.cells
+        while len(tiles) > len(cells):
+            Block.tile_pool.release(tiles.pop())
+        while len(tiles) < len(cells):
+            tiles.append(Block.tile_pool.acquire(self.grid, colour, Vector2(0, 0)))
+        for tile, (x, y) in zip(tiles, cells):
+            tile.reset(self.grid, colour, tile.grid_pos)
+            tile.grid_pos.x = self._grid_pos.x+x
+            tile.grid_pos.y = self._grid_pos.y+y
 
     def spawn(self):
-        for tile in self.get_tiles_only():
-            self.grid.map[tile.grid_pos.y][tile.grid_pos.x] = 1
+        self.grid.add_active(tile.grid_pos for tile in self.get_tiles_only())
 
+    def release(self):
+        Block.pool.release(self)
 
-    def get_tiles_only(self):
-        if self.only_tiles:
-            return self.only_tiles
-        self.only_tiles = []
 
-        # Merge tiles
-        for row in self.tiles:
-            self.only_tiles.extend(row)
-        self.only_tiles = list(filter(lambda x: x is not None,self.only_tiles))
-        return self.only_tiles
+    def get_tiles_only(self):
+        return self.tiles
 
 
     @property
@@ -240,102 +802,195 @@ class Block:
         self.grid_pos_updated = True
         if not self._bin_grid_pos:
             self._bin_grid_pos = self._grid_pos.copy()
-        print(self._grid_pos, self._bin_grid_pos)
         return self._bin_grid_pos
 
     @grid_pos.setter
     def grid_pos(self, new_value):
-        displacement = new_value-self._grid_pos
-        print(displacement)
-        move_hor = True if displacement.x else False
-        move_ver = True if displacement.y else False
+        pos = self._grid_pos
+        dx = new_value.x-pos.x
+        dy = new_value.y-pos.y
 
-        if not (move_hor or move_ver):
+        if not (dx or dy):
             return
-        dx = 0 if displacement.x < 0 else -1
-        falls = displacement.y+1
-
-        for row in range(len(self.tiles)):
-            r = list(filter(lambda x: x is not None, self.tiles[row]))
-
-            if move_hor:
-                if not(0 <= r[dx].grid_pos.x+displacement.x <= self.grid.dims.x-1) or (
-                        r[dx].grid_pos.y > -1 and self.grid.map[r[dx].grid_pos.y][r[dx].grid_pos.x+displacement.x]):
-                    move_hor = False
-
-            if move_ver:
-                for tile in r:
-                    #print(Vector2(tile.grid_pos.y+displacement.y,tile.grid_pos.x))
-                    if (not tile.grid_pos.y+displacement.y <= self.grid.dims.y-1) or (
-                            tile.grid_pos.y+displacement.y > -1 and self.grid.map[tile.grid_pos.y+displacement.y][tile.grid_pos.x]):
-                        if -1<row+displacement.y<len(self.tiles) and self.tiles[row+displacement.y][self.tiles[row].index(tile)]:
-                            continue
-                        move_ver = False
-                        if self.falling:
-                            self.falling = False
-                            print("locking")
-                            pygame.time.set_timer(lock_delay_timer, int(1000*lock_delay/tps))
-                        break
-
-        if not (move_hor or move_ver):
+
+        # Each axis is one mask test, horizontal first
+        if dx and self.grid.collides(self.shape, pos.x+dx, pos.y):
+            dx = 0
+        if dy and self.grid.collides(self.shape, pos.x+dx, pos.y+dy):
+            dy = 0
+            if self.falling:
+                self.falling = False
+                pygame.time.set_timer(lock_delay_timer, int(1000*lock_delay/tps))
+
+        if not (dx or dy):
             return
 
         self.falling = True
         pygame.time.set_timer(lock_delay_timer, int(1000*lock_delay/tps))
-        displacement.x *= move_hor
-        displacement.y *= move_ver
-        self._grid_pos += displacement
-        for tile in self.get_tiles_only():
-            tile.grid_pos += displacement
-            self.grid.update_tile(tile.prev_grid_pos, tile.grid_pos)
-        self.grid.update_map()
-        print()
-        print(self.grid)
-        print()
-
-    def draw(self, window, surf=None, pos=(0,0)):
-        window.blit(pygame.transform.scale(self.icon_surf, list(Vector2(point=self.icon_surf.get_size())*(surf.get_height()/tile_size))),pos)
+        pos.x += dx
+        pos.y += dy
+        self.grid.remove_active(tile.grid_pos for tile in self.tiles)
+        for tile in self.tiles:
+            tile.grid_pos.x += dx
+            tile.grid_pos.y += dy
+        self.grid.add_active(tile.grid_pos for tile in self.tiles)
+
+    def rotate(self, direction=1):
+        # Quarter turn (clockwise if direction > 0), one mask test per kick
+        self.apply_moves()
+        if direction > 0:
+            shape, kicks = SHAPES[self.shape.cw], self.shape.cw_kicks
+        else:
+            shape, kicks = SHAPES[self.shape.ccw], self.shape.ccw_kicks
+        pos = self._grid_pos
+        for dx, dy in kicks:
+            if not self.grid.collides(shape, pos.x+dx, pos.y+dy):
+                break
+        else:
+            return False
 
-    def update(self, delta_t, window, redraw=True):
+        self.falling = True
+        pygame.time.set_timer(lock_delay_timer, int(1000*lock_delay/tps))
+        self.layout = shape.layout
+        self.shape = shape
+        pos.x += dx
+        pos.y += dy
+        self.grid.remove_active(tile.grid_pos for tile in self.tiles)
+        for tile, (cx, cy) in zip(self.tiles, shape.cells):
+            tile.grid_pos.x = pos.x+cx
+            tile.grid_pos.y = pos.y+cy
+        self.grid.add_active(tile.grid_pos for tile in self.tiles)
+        return True
+
+    def apply_moves(self):
         if self.grid_pos_updated:
             self.grid_pos_updated = False
             #print ("bin "+ str(self._bin_grid_pos))
             self.grid_pos = self._bin_grid_pos
             self._bin_grid_pos = None
+
+    def get_ghost_row(self):
+        key = (self._grid_pos.x, self._grid_pos.y, self.layout, self.grid.version)
+        if key != self.ghost_key:
+            self.ghost_key = key
+            self.ghost_row = self.grid.drop_row(self.shape, self._grid_pos.x, self._grid_pos.y)
+        return self.ghost_row
+
+    def key(self):
+        # Shape and position, for hashing
+        pos = self._grid_pos
+        return LAYOUT_IDS[self.layout] << 40 | (pos.x & 0xfffff) << 20 | pos.y & 0xfffff
+
+    def hard_drop(self):
+        self.apply_moves()
+        self.grid_pos = Vector2(self._grid_pos.x, self.get_ghost_row())
+
+    def screen_rect(self):
+        # Area covered by the block and its ghost
+        y = self._grid_pos.y
+        left, top = self.grid.grid_pos_to_coord(Vector2(self._grid_pos.x, y))
+        return pygame.Rect(left, top, self.shape.width*tile_size+1,
+                           (self.get_ghost_row()-y+self.shape.height)*tile_size+1)
+
+    def queue_draw(self, commands):
+        for tile in self.get_tiles_only():
+            tile.queue_draw(commands)
+
+    def draw_ghost(self, window):
+        y = self.get_ghost_row()
+        for cx, cy in self.shape.cells:
+            if y+cy > -1:
+                pygame.draw.rect(window, self.colour,
+                    (*self.grid.grid_pos_to_coord(Vector2(self._grid_pos.x+cx, y+cy)), tile_size, tile_size), 2)
+
+    def update(self, delta_t, window, redraw=True):
+        self.apply_moves()
         for tile in self.get_tiles_only():
             tile.update(delta_t,window,redraw)
 
 
+Block.pool = Pool(Block)
+
+
+class QueuedBlock:
+    # A block waiting in the queue, its tiles are only made by build()
+    icons = LRUCache(32)
+    previews = LRUCache(32)
+    pool = None
+
+    def __init__(self, layout, colour):
+        self.reset(layout, colour)
+
+    def reset(self, layout, colour):
+        self.layout = layout
+        self.colour = colour
+
+    @staticmethod
+    def factory(layout):
+        colour = [random.randint(0,255) for i in range(3)]
+        if sum(colour)/3 > 200:
+            colour = list(map(lambda x: int(x*0.8), colour))
+        return QueuedBlock.pool.acquire(layout, colour)
+
+    # Turns the descriptor into a block, the descriptor goes back to the pool
+    def build(self, grid):
+        QueuedBlock.pool.release(self)
+        return Block.pool.acquire(grid, self.layout, self.colour)
+
+    @property
+    def icon_surf(self):
+        key = (self.layout, tuple(self.colour))
+        icon = QueuedBlock.icons.get(key)
+        if icon is None:
+            sprite = TintedTiles.get(self.colour)
+            shape = SHAPES[self.layout]
+            icon = Display.surface((tile_size*shape.width,tile_size*shape.height))
+            for x, y in shape.cells:
+                icon.blit(sprite, (x*tile_size, y*tile_size))
+            QueuedBlock.icons[key] = icon
+        return icon
+
+    def preview(self, size):
+        # The icon scaled to cells of size pixels, kept per block and size
+        key = (self.layout, tuple(self.colour), size)
+        preview = QueuedBlock.previews.get(key)
+        if preview is None:
+            preview = pygame.transform.scale(self.icon_surf, list(Vector2(point=self.icon_surf.get_size())*(size/tile_size)))
+            QueuedBlock.previews[key] = preview
+        return preview
+
+
+QueuedBlock.pool = Pool(QueuedBlock)
+Display.on_change(QueuedBlock.icons.clear)
+Display.on_change(QueuedBlock.previews.clear)
+
+
 class TetrisGame:
     def __init__(self, window, pos):
         # Scene Size
         self.size = wind_size
-        self.surf = pygame.Surface(tuple(self.size))
+        self.surf = Display.surface(self.size)
         if pos == "CENTERED":
             self.pos = (Vector2(point=pygame.display.get_window_size())-self.size)*0.5
         else:
             self.pos = pos
 
         # Font
-        self.font = pygame.font.SysFont('arial', 40)
+        self.font = Assets.font('arial', 40)
 
         # Audio
-        self.lock_sound = pygame.mixer.Sound(ASSETS_PATH+"laserShoot.mp3")
-        self.clear_sound = pygame.mixer.Sound(ASSETS_PATH+"powerUp.wav")
-        self.event_sound = pygame.mixer.Sound(ASSETS_PATH+"explosion.wav")
+        self.lock_sound = Assets.sound(ASSETS_PATH+"laserShoot.mp3")
+        self.clear_sound = Assets.sound(ASSETS_PATH+"powerUp.wav")
+        self.event_sound = Assets.sound(ASSETS_PATH+"explosion.wav")
 
         # Game Grid
-        self.grid = Grid(window, "CENTERED", GRID_DIMS)
-
-        # Tiles init
-        self.tiles = TileList()
+        self.grid = GRID_BACKENDS[GRID_BACKEND](window, "CENTERED", GRID_DIMS, view_dims=VIEW_DIMS)
 
         # Warning zone
         self.danger_rect = pygame.Rect(
             (self.grid.pos.x,self.grid.pos.y-2*tile_size),
-            (self.grid.dims.x*tile_size, 2*tile_size))
-        self.bs = pygame.Surface(self.danger_rect.size)
-        self.bs.set_alpha(100)
+            (self.grid.size.x, 2*tile_size))
+        self.bs = Display.surface(self.danger_rect.size, alpha=100)
         self.bs.fill((255,50,50))
 
         # Loot tables
@@ -354,11 +1009,11 @@ class TetrisGame:
 
         self.GRID_EVENTS = LootTable(
             LootTableItem({"id": 0, "function": self.grid.invert_grid,
-                           "args": [self.tiles, self.surf]}, 10),
+                           "args": []}, 10),
             LootTableItem({"id": 1, "function": self.grid.scroll_grid,
-                           "args": [self.tiles, self.surf, -1]},20),
+                           "args": [-1]},20),
             LootTableItem({"id": 2, "function": self.grid.scroll_grid,
-                           "args": [self.tiles, self.surf, 1]}, 20),
+                           "args": [1]}, 20),
             LootTableItem({"id": 3, "function": self.extend_queue, "args": []},2),
             LootTableItem({"id": 4, "function": self.shorten_queue, "args": []},2),
             LootTableItem({"id": 5, "function": self.gravity_up, "args": [1.4]},5),
@@ -398,8 +1053,26 @@ class TetrisGame:
         self.grid_event_anims = list(map(
             lambda x: Animation(self, "curr_grid_event_sprite", x, len(x), True),
             event_sprites))
+        Display.on_change(self.convert)
+
+        # Warm the pools so the first game doesn't allocate pieces
+        Block.pool.prefill(2, self.grid, O, W)
+        QueuedBlock.pool.prefill(8, O, W)
+
+        # Areas of self.surf to redraw, and those redrawn this frame
+        self.dirty = DirtyRects(self.surf.get_rect())
+        self.redrawn = []
+        # Set by invalidate while something may draw over the game (a
+        # popup), until update redraws it
+        self.covered = False
+        # Blits of the layer being rendered
+        self.commands = BlitBuffer()
 
         # Reset game values
+        self.current_tile = None
+        self.block_queue = []
+        # (preview, position) of each queued block, None when out of date
+        self.queue_layout = None
         self.reset()
         self.highscore = 0
 
@@ -437,17 +1110,40 @@ class TetrisGame:
         self.cleared_lines_text = self.font.render("Cleared:", True, W)
         self.points_text = self.font.render(str(self.points), False, W)
 
-        self.tiles.clear()
-
-        self.block_queue = [
-                Block.factory(self.LAYOUTS.random_item(),self.grid, self.tiles)
-            for _ in range(4)]
-        self.current_tile = self.block_queue.pop(0)
-    
-        self.surface_queue = [pygame.Surface((20,20)) for _ in self.block_queue]
+        # Hand the previous game's pieces back to the pools
+        if self.current_tile:
+            self.current_tile.release()
+        QueuedBlock.pool.release(*self.block_queue)
+
+        self.block_queue.clear()
+        self.block_queue.extend(
+                QueuedBlock.factory(self.LAYOUTS.random_item())
+            for _ in range(4))
+        self.current_tile = self.block_queue.pop(0).build(self.grid)
+        self.current_tile.spawn()
+        self.queue_layout = None
+        self.invalidate()
     
         self.hard_dropped = False
 
+    def state_hash(self):
+        # Board, falling block and queue in one 64 bit value
+        state = self.grid.hash
+        if self.current_tile:
+            state ^= mix64(self.current_tile.key() ^ 0x5851F42D4C957F2D)
+        queue = 0
+        for queued in self.block_queue:
+            queue = mix64(queue ^ LAYOUT_IDS[queued.layout])
+        return state ^ queue
+
+    def layout_queue(self):
+        self.queue_layout = []
+        temp_height = 50
+        for queued in self.block_queue:
+            preview = queued.preview(queue_tile_size)
+            self.queue_layout.append((preview, (50,temp_height)))
+            temp_height += preview.get_height() + 20
+
     def gravity_up(self, modifier=1.15):
         self.gravity = max(1, self.gravity/modifier)
 
@@ -456,8 +1152,8 @@ class TetrisGame:
             raise ValueError("expected: 0 <= int(amount); received "+str(amount))
         for i in range(amount):
             self.block_queue.append(
-                Block.factory(self.LAYOUTS.random_item(),self.grid, self.tiles))
-            self.surface_queue.append(self.surface_queue[0].copy())
+                QueuedBlock.factory(self.LAYOUTS.random_item()))
+        self.queue_layout = None
 
     def shorten_queue(self, amount=1):
         if amount < 0:
@@ -465,11 +1161,99 @@ class TetrisGame:
         for i in range(amount):
             if len(self.block_queue) <= 1:
                 break
-            self.block_queue.pop()
-            self.surface_queue.pop()
+            QueuedBlock.pool.release(self.block_queue.pop())
+        self.queue_layout = None
+
+    def convert(self):
+        # Surfaces in a new display format, then a full redraw
+        self.surf = Display.convert(self.surf)
+        self.bs = Display.convert(self.bs)
+        self.grid.convert()
+        for anim in self.grid_event_anims:
+            anim.frames = [Display.convert(frame) for frame in anim.frames]
+        if self.curr_grid_event_sprite is not None:
+            anim = self.grid_event_anims[self.grid_event["id"]]
+            self.curr_grid_event_sprite = anim.frames[min(anim.curr_frame, len(anim.frames)-1)]
+        # The queue previews come from the cleared caches
+        self.queue_layout = None
+        self.invalidate()
+
+    def invalidate(self):
+        # Redraw everything next frame, e.g. after a menu covered the game
+        self.dirty.add_all()
+        self.redrawn = [self.surf.get_rect()]
+        self.covered = True
+
+    @property
+    def frame_rects(self):
+        # Areas of the window changed by the last draw
+        return [rect.move(self.pos.x, self.pos.y) for rect in self.redrawn]
 
     def draw(self, window):
-        window.blit(self.surf, tuple(self.pos))
+        # While covered a popup draws over the game every frame, so all of
+        # it goes out again
+        rects = [self.surf.get_rect()] if self.covered else self.redrawn
+        window.blits([(self.surf, (self.pos.x+rect.x, self.pos.y+rect.y), rect)
+                      for rect in rects], doreturn=False)
+
+    def track_changes(self):
+        # Each element marks where it was and is drawn when it changes
+        dirty = self.dirty
+        board = self.grid.clip_rect(above=2)
+        dirty.track("board", (self.grid.version, self.grid.view.topleft), board)
+        if self.current_tile:
+            block = self.current_tile
+            dirty.track("block",
+                (block.layout, tuple(block._grid_pos), block.get_ghost_row(), tuple(block.colour)),
+                block.screen_rect().clip(board))
+
+        if self.queue_layout is None:
+            self.layout_queue()
+            rects = [preview.get_rect(topleft=pos) for preview, pos in self.queue_layout]
+            dirty.track("queue", tuple(preview for preview, pos in self.queue_layout),
+                        rects[0].unionall(rects[1:]))
+
+        for key, surf, pos in (
+                ("countdown", self.countdown_text, (wind_size.x*0.8,wind_size.y*0.7)),
+                ("event", self.curr_grid_event_sprite, (wind_size.x*0.8,wind_size.y*0.75)),
+                ("cleared", self.cleared_lines_text, (wind_size.x*0.8,wind_size.y*0.1)),
+                ("points", self.points_text, (wind_size.x*0.8,wind_size.y*0.15))):
+            dirty.track(key, surf, surf.get_rect(topleft=pos))
+
+    def render(self, area):
+        # Draws every layer, clipped to area
+        self.surf.set_clip(area)
+        self.surf.fill(BK)
+
+        # Background and locked tiles
+        self.surf.blit(self.grid.board_layer(), tuple(self.grid.pos))
+
+        # current_tile
+        commands = self.commands
+        if self.current_tile:
+            self.surf.set_clip(self.grid.clip_rect(above=2).clip(area))
+            self.current_tile.draw_ghost(self.surf)
+            self.current_tile.queue_draw(commands)
+            commands.submit(self.surf)
+            self.surf.set_clip(area)
+
+        # Block Queue
+        for preview, pos in self.queue_layout:
+            commands.add(preview, pos)
+
+        # Event Countdown
+        commands.add(self.countdown_text, (wind_size.x*0.8,wind_size.y*0.7))
+        commands.add(self.curr_grid_event_sprite, (wind_size.x*0.8,wind_size.y*0.75))
+
+        # Points
+        commands.add(self.cleared_lines_text, (wind_size.x*0.8,wind_size.y*0.1))
+        commands.add(self.points_text, (wind_size.x*0.8,wind_size.y*0.15))
+
+        # Danger zone (above the board, so only while the view is at the top)
+        if not self.grid.view.top:
+            commands.add(self.bs, self.danger_rect)
+        commands.submit(self.surf)
+        self.surf.set_clip(None)
 
     def update(self, delta_t, window, events, redraw=True):
 
@@ -495,12 +1279,13 @@ class TetrisGame:
                         return {"id": 1, "scene": "GameOver"}
 
                     # Points/clear tiles
-                    self.tiles += self.current_tile.get_tiles_only()
+                    self.grid.lock_active(
+                        (tile.grid_pos for tile in self.current_tile.get_tiles_only()),
+                        self.current_tile.colour)
                     cleared = len(
                         self.grid.clear_lines(
-                            self.tiles, self.surf,
                             start=self.current_tile.grid_pos.y,
-                            amount=len(self.current_tile.tiles)))
+                            amount=self.current_tile.shape.height))
                     if cleared:
                         self.clear_sound.play()
                     self.points += cleared
@@ -524,8 +1309,11 @@ class TetrisGame:
 
                     self.countdown_text = self.font.render("Next: "+str(self.event_countdown), False, W)
 
-                    self.current_tile = self.block_queue.pop(0)
-                    self.block_queue.append(Block.factory(self.LAYOUTS.random_item(), self.grid, self.tiles))
+                    self.current_tile.release()
+                    self.current_tile = self.block_queue.pop(0).build(self.grid)
+                    self.current_tile.spawn()
+                    self.block_queue.append(QueuedBlock.factory(self.LAYOUTS.random_item()))
+                    self.queue_layout = None
 
 
         # Click inputs
@@ -545,12 +1333,13 @@ class TetrisGame:
             if Input.is_just_pressed("A_DOWN"):
                 self.p_timer = player_move_delay
                 self.current_tile.grid_pos.y += 1
+            if Input.is_just_pressed("A_ROTATE"):
+                self.current_tile.rotate(1)
+            if Input.is_just_pressed("A_ROTATE_CCW"):
+                self.current_tile.rotate(-1)
             # Quick drop
             if Input.is_just_pressed("A_UP"):
-                while self.current_tile.falling:
-                    self.current_tile.grid_pos.y += 1
-                    self.current_tile.update(delta_t, self.surf, False)
-                    self.grid.update_map()
+                self.current_tile.hard_drop()
                 self.hard_dropped = True
 
         # Handle events (old form)
@@ -578,38 +1367,21 @@ class TetrisGame:
         # Next event
         self.grid_event_anims[self.grid_event["id"]].update(delta_t, window)
         
-        # Update grid map
-        self.grid.update_map()
-
-        # Draw
-        self.surf.fill(BK)
-
-        # draw grid
-        self.surf.blit(self.grid.bg, tuple(self.grid.pos))
-
         # update current_tile
         if self.current_tile:
-            self.current_tile.update(delta_t, self.surf)
-
-        # Draw idle tiles
-        self.tiles.draw(self.surf)
-
-        # Block Queue
-        temp_height = 50
-        for i in range(len(self.block_queue)):
-            self.block_queue[i].draw(self.surf, self.surface_queue[i], (50,temp_height))
-            temp_height += self.block_queue[i].icon_surf.get_height()*(self.surface_queue[i].get_height()/tile_size) + 20
-
-        # Event Countdown
-        self.surf.blit(self.countdown_text, (wind_size.x*0.8,wind_size.y*0.7))
-        self.surf.blit(self.curr_grid_event_sprite, (wind_size.x*0.8,wind_size.y*0.75))
-
-        # Points
-        self.surf.blit(self.cleared_lines_text, (wind_size.x*0.8,wind_size.y*0.1))
-        self.surf.blit(self.points_text, (wind_size.x*0.8,wind_size.y*0.15))
-
-        # Danger zone
-        self.surf.blit(self.bs, self.danger_rect)
+            self.current_tile.apply_moves()
+            # Keep the block, and its landing spot if it fits, in view
+            block = self.current_tile
+            self.grid.follow(block._grid_pos.x, block._grid_pos.y, block.shape.width,
+                             block.get_ghost_row()-block._grid_pos.y+block.shape.height)
+            self.current_tile.update(delta_t, self.surf, redraw=False)
+
+        # Draw only what changed
+        self.track_changes()
+        self.redrawn = self.dirty.pop()
+        for rect in self.redrawn:
+            self.render(rect)
+        self.covered = False
 
         if redraw:
             self.draw(window)
@@ -4,6 +4,7 @@ import functools
 from math import sqrt, floor
 import random
 import os
+from collections import OrderedDict
 ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets/')
 
 VIDEO_FLAGS = pygame.HWSURFACE|pygame.DOUBLEBUF
@@ -34,6 +35,8 @@ keybinds = {
         "A_RIGHT": (pygame.K_RIGHT, pygame.K_d),
         "A_DOWN": (pygame.K_DOWN, pygame.K_s),
         "A_UP": (pygame.K_UP, pygame.K_w),
+        "A_ROTATE": (pygame.K_e, pygame.K_x),
+        "A_ROTATE_CCW": (pygame.K_q, pygame.K_z),
         "UI_SELECT": (pygame.K_SPACE, pygame.K_RETURN),
         "UI_CANCEL": [pygame.K_ESCAPE],
 }
@@ -256,8 +259,7 @@ class Progressbar:
                  fore_colour=(255,0,0)):
 
         self.rect = rect
-        self.bar = pygame.Surface((rect.width,rect.height))
-        self.bar.set_alpha(180)
+        self.bar = Display.surface((rect.width,rect.height), alpha=180)
 
         self.direction = direction
 
@@ -327,11 +329,276 @@ class LootTable:
     	
     	return None
 
+class Pool:
+    # Keeps released objects so they can be reset and reused
+    # instead of allocating new ones
+    def __init__(self, factory):
+        self.factory = factory
+        self.free = []
+
+    def acquire(self, *args):
+        if self.free:
+            item = self.free.pop()
+            item.reset(*args)
+            return item
+        return self.factory(*args)
+
+    def release(self, *items):
+        self.free.extend(items)
+
+    def prefill(self, amount, *args):
+        self.free.extend(self.factory(*args) for _ in range(amount))
+
+
+class LRUCache(OrderedDict):
+    # Dict that drops its least recently used entry past maxsize
+    def __init__(self, maxsize=128):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+class Palette:
+    # Maps colours to byte sized indices, index 0 is the empty colour
+    def __init__(self, empty=BK, size=256):
+        self.empty = tuple(empty)
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.colours = [self.empty]
+        self.indices = {}
+        self.free = []
+        # Cells using each index
+        self.counts = [0]
+
+    def __getitem__(self, index):
+        return self.colours[index]
+
+    def __len__(self):
+        return len(self.colours)
+
+    def index(self, colour):
+        colour = tuple(colour)
+        if colour in self.indices:
+            return self.indices[colour]
+
+        if self.free:
+            index = self.free.pop()
+            self.colours[index] = colour
+        elif len(self.colours) < self.size:
+            index = len(self.colours)
+            self.colours.append(colour)
+            self.counts.append(0)
+        else:
+            return self.nearest(colour)
+        self.indices[colour] = index
+        return index
+
+    def nearest(self, colour):
+        return min(range(1, len(self.colours)),
+                   key=lambda i: sum((a-b)**2 for a, b in zip(self.colours[i], colour)))
+
+    def hold(self, index, amount=1):
+        # Changes the cells using index, freeing it once none do
+        self.counts[index] += amount
+        if not self.counts[index] and index not in self.free:
+            del self.indices[self.colours[index]]
+            self.free.append(index)
+
+
+class Assets:
+    # Process wide cache of images, sounds and fonts, keyed by path (or
+    # font name) and load options. Loaded assets are shared, so callers
+    # must copy before drawing onto or changing them
+    cache = {}
+    hits = 0
+    misses = 0
+    bytes = 0
+
+    @staticmethod
+    def get(key, load):
+        if key in Assets.cache:
+            Assets.hits += 1
+            return Assets.cache[key]
+        Assets.misses += 1
+        asset, size = load()
+        Assets.cache[key] = asset
+        Assets.bytes += size
+        return asset
+
+    @staticmethod
+    def image(path, alpha=True, scale=1):
+        def load():
+            if scale != 1:
+                image = pygame.transform.scale_by(Assets.image(path, alpha), scale)
+            else:
+                image = pygame.image.load(path)
+                image = image.convert_alpha() if alpha else image.convert()
+            return image, image.get_pitch()*image.get_height()
+        return Assets.get(("image", path, alpha, scale), load)
+
+    @staticmethod
+    def sound(path):
+        def load():
+            sound = pygame.mixer.Sound(path)
+            size = 0
+            if pygame.mixer.get_init():
+                frequency, size_format, channels = pygame.mixer.get_init()
+                size = int(sound.get_length()*frequency*channels*abs(size_format)//8)
+            return sound, size
+        return Assets.get(("sound", path), load)
+
+    @staticmethod
+    def font(name, size, bold=False):
+        return Assets.get(("font", name, size, bold),
+                          lambda: (pygame.font.SysFont(name, size, bold=bold), 0))
+
+    @staticmethod
+    def stats():
+        return {"hits": Assets.hits, "misses": Assets.misses,
+                "bytes": Assets.bytes, "entries": len(Assets.cache)}
+
+    @staticmethod
+    def convert():
+        # Cached images in the current display format
+        for key, asset in Assets.cache.items():
+            if key[0] == "image":
+                Assets.cache[key] = Display.convert(asset)
+
+
+class Display:
+    # Makes surfaces in the display's pixel format, so blits between them
+    # don't convert every pixel. Whatever keeps converted surfaces registers
+    # a refresh for when set_mode changes that format
+    format = None
+    refreshers = []
+    # set_mode calls so far, each one clears the display
+    modes = 0
+
+    @staticmethod
+    def surface(size, per_pixel=False, alpha=None):
+        # per_pixel: SRCALPHA, starting transparent. Otherwise opaque, with
+        # alpha (0-255) applied to the whole surface if given
+        size = (int(size[0]), int(size[1]))
+        if per_pixel:
+            return Display.convert(pygame.Surface(size, pygame.SRCALPHA))
+        # Converted first, set_alpha also sets SRCALPHA under pygame 2
+        surface = Display.convert(pygame.Surface(size))
+        if alpha is not None:
+            surface.set_alpha(alpha)
+        return surface
+
+    @staticmethod
+    def convert(surface):
+        # Keeps per pixel alpha, or the surface alpha and colour key. Only an
+        # alpha mask means per pixel alpha, SRCALPHA is set by set_alpha too
+        if pygame.display.get_surface() is None:
+            return surface
+        if surface.get_masks()[3]:
+            return surface.convert_alpha()
+        alpha, colour_key = surface.get_alpha(), surface.get_colorkey()
+        surface = surface.convert()
+        if alpha is not None:
+            surface.set_alpha(alpha)
+        if colour_key is not None:
+            surface.set_colorkey(colour_key)
+        return surface
+
+    @staticmethod
+    def set_mode(size, flags=0):
+        window = pygame.display.set_mode(size, flags)
+        Display.modes += 1
+        old, Display.format = Display.format, (window.get_bitsize(), window.get_masks())
+        if old is not None and old != Display.format:
+            for refresh in Display.refreshers:
+                refresh()
+        return window
+
+    @staticmethod
+    def on_change(refresh):
+        Display.refreshers.append(refresh)
+
+
+Display.on_change(Assets.convert)
+
+
+class DirtyRects:
+    # Collects the areas of a surface that changed since the last frame
+    def __init__(self, bounds):
+        self.bounds = pygame.Rect(bounds)
+        self.rects = []
+        # What each tracked element last drew, and where
+        self.drawn = {}
+
+    def add(self, rect):
+        # A pixel of slack for positions that aren't whole numbers
+        rect = self.bounds.clip(pygame.Rect(rect).inflate(2, 2))
+        if rect.width and rect.height:
+            self.rects.append(rect)
+
+    def add_all(self):
+        self.rects = [self.bounds.copy()]
+
+    def track(self, key, state, rect):
+        # Marks the old and new area of an element if it changed
+        old = self.drawn.get(key)
+        if old is None or old[0] != state or old[1] != rect:
+            if old is not None:
+                self.add(old[1])
+            self.add(rect)
+            self.drawn[key] = (state, pygame.Rect(rect))
+
+    def pop(self):
+        # Merges overlapping areas and starts the next frame
+        rects = []
+        for rect in self.rects:
+            i = rect.collidelist(rects)
+            while i != -1:
+                rect = rect.union(rects.pop(i))
+                i = rect.collidelist(rects)
+            rects.append(rect)
+        self.rects = []
+        # Past half the surface one big area is cheaper
+        if sum(rect.width*rect.height for rect in rects) > self.bounds.width*self.bounds.height//2:
+            return [self.bounds.copy()]
+        return rects
+
+
+class BlitBuffer:
+    # Blits collected while drawing a layer, then handed to Surface.blits
+    # in one call rather than one Python call each
+    def __init__(self):
+        self.commands = []
+
+    def add(self, source, dest, area=None):
+        if area is None:
+            self.commands.append((source, dest))
+        else:
+            self.commands.append((source, dest, area))
+
+    def submit(self, surface):
+        if self.commands:
+            surface.blits(self.commands, doreturn=False)
+            self.commands.clear()
+
+
 #https://www.pygame.org/wiki/Spritesheet
 class SpriteSheet(object):
     def __init__(self, filename):
         try:
-            self.sheet = pygame.image.load(filename).convert_alpha()
+            self.sheet = Assets.image(filename)
         except (pygame.error) as message:
             print('Unable to load spritesheet image:', filename)
             raise SystemExit(message)
@@ -340,12 +607,15 @@ class SpriteSheet(object):
     def image_at(self, rectangle, colorkey = None):
         "Loads image from x,y,x+offset,y+offset"
         rect = pygame.Rect(rectangle)
-        image = pygame.Surface(rect.size).convert_alpha()
+        if colorkey is None:
+            # Straight copy, keeping the sheet's transparency
+            return Display.convert(self.sheet.subsurface(rect).copy())
+        # Colour keys go on opaque surfaces, not per pixel alpha ones
+        image = Display.surface(rect.size)
         image.blit(self.sheet, (0, 0), rect)
-        if colorkey is not None:
-            if colorkey == -1:
-                colorkey = image.get_at((0,0))
-            image.set_colorkey(colorkey, pygame.RLEACCEL)
+        if colorkey == -1:
+            colorkey = image.get_at((0,0))
+        image.set_colorkey(colorkey, pygame.RLEACCEL)
         return image
 
     # Load a whole bunch of images and return them as a list